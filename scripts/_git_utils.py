@@ -0,0 +1,46 @@
+from __future__ import annotations
+
+import os
+import re
+import subprocess
+from typing import Iterable
+
+
+GITLINK_MODE = b"160000"
+
+# One `git diff --raw -z` record: ":<old mode> <new mode> <old sha> <new sha> <status>\0<path>\0".
+# Renames/copies carry the source path before the destination path; group 4 is always the destination.
+_RAW_RECORD_RE = re.compile(
+    rb":(\d{6}) (\d{6}) [0-9a-f]+ [0-9a-f]+ (?:[RC]\d*\0([^\0]*)\0|[A-Z]\d*\0)([^\0]*)\0"
+)
+
+
+def diff_raw(base: str, head: str) -> bytes:
+    # Full SHAs are never followed by "..." (GIT_PRINT_SHA1_ELLIPSIS), which the record regex relies on.
+    return subprocess.check_output(["git", "diff", "--raw", "-z", "--no-abbrev", base, head])
+
+
+def parse_raw_diff(raw: bytes) -> tuple[list[str], set[str]]:
+    """Returns (changed gitlink paths in diff order, all changed paths)."""
+    gitlinks: list[str] = []
+    changed: set[str] = set()
+    for m in _RAW_RECORD_RE.finditer(raw):
+        path = os.fsdecode(m.group(4))
+        changed.add(path)
+        if m.group(1) == GITLINK_MODE and m.group(2) == GITLINK_MODE:
+            gitlinks.append(path)
+    return gitlinks, changed
+
+
+def diff_changes(base: str, head: str) -> tuple[list[str], set[str]]:
+    """Returns (changed gitlink paths in diff order, all changed paths) between two commits."""
+    return parse_raw_diff(diff_raw(base, head))
+
+
+def changed_gitlinks(base: str, head: str) -> set[str]:
+    return set(diff_changes(base, head)[0])
+
+
+def worktree_diff(paths: Iterable[str]) -> str:
+    """Returns the unstaged diff of the given tracked files (empty when they match the index)."""
+    return subprocess.check_output(["git", "diff", "--", *paths], text=True)
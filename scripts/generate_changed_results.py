@@ -4,113 +4,209 @@ from __future__ import annotations
 
 import argparse
 import os
+import queue
 import shutil
 import subprocess
 import sys
-from dataclasses import dataclass
+import tempfile
+import threading
+import uuid
 from pathlib import Path
-from typing import Iterable
+from typing import Iterable, NamedTuple
+
+from _git_utils import changed_gitlinks, worktree_diff
 
 
 ROOT = Path(__file__).resolve().parents[1]
 RUNS_DIR = ROOT / ".runs"
+# Runner logs live outside .runs/<rule>/<language> so runners and aggregators only see their own files.
+LOGS_DIR = RUNS_DIR / ".logs"
+
+_WRITTEN_RESULTS: set[Path] = set()
 
 
-@dataclass(frozen=True)
-class Toolchain:
+class Toolchain(NamedTuple):
     language: str
     runner: Path
     aggregator: Path
 
 
-def run_cmd(cmd: list[str], *, cwd: Path | None = None, env: dict | None = None) -> None:
-    # Merge env if provided
-    final_env = os.environ.copy()
-    if env:
-        final_env.update(env)
+# On failure only the end of a command's output is surfaced in the error message.
+_TAIL_BYTES = 64 * 1024
 
-    proc = subprocess.run(cmd, cwd=str(cwd) if cwd else None, env=final_env, text=True, capture_output=True)
-    if proc.returncode != 0:
-        raise RuntimeError(
-            f"Command failed ({proc.returncode}): {' '.join(cmd)}\n"
-            f"{proc.stderr.strip() or proc.stdout.strip()}"
+
+def _output_file(path: Path | None):
+    return open(path, "w+b", buffering=0) if path else tempfile.TemporaryFile()
+
+
+def _read_tail(f) -> str:
+    size = f.seek(0, os.SEEK_END)
+    f.seek(max(0, size - _TAIL_BYTES))
+    return f.read().decode(errors="replace")
+
+
+def _spawn(
+    cmd: list[str],
+    *,
+    cwd: Path | None = None,
+    env: dict | None = None,
+    stdout_path: Path | None = None,
+    stderr_path: Path | None = None,
+) -> tuple[int, str, str]:
+    """Runs `cmd`, returning (returncode, stdout tail, stderr tail); tails are only read on failure."""
+    # Without preexec_fn (and the other fork-only options), _posixsubprocess spawns via vfork on
+    # Linux (CPython 3.10+), so spawn cost does not grow with the parent's memory.
+    # Output goes to files (logs or unlinked temp files) rather than pipes so it stays off the heap.
+    with _output_file(stdout_path) as out_f, _output_file(stderr_path) as err_f:
+        proc = subprocess.Popen(
+            cmd,
+            cwd=str(cwd) if cwd else None,
+            env=env,
+            stdout=out_f,
+            stderr=err_f,
+            close_fds=True,
         )
+        returncode = proc.wait()
+        if returncode == 0:
+            return returncode, "", ""
+        return returncode, _read_tail(out_f), _read_tail(err_f)
 
 
-def changed_gitlinks(base: str, head: str) -> set[str]:
-    raw = subprocess.check_output(["git", "diff", "--raw", base, head], text=True)
-    changed: set[str] = set()
-    for line in raw.splitlines():
-        parts = line.split("\t", 1)
-        if len(parts) != 2:
-            continue
-        meta, path = parts
-        meta_parts = meta.split()
-        if len(meta_parts) < 3:
-            continue
-        old_mode = meta_parts[0].lstrip(":")
-        new_mode = meta_parts[1]
-        if old_mode == "160000" and new_mode == "160000":
-            changed.add(path.strip())
-    return changed
+def run_cmd(
+    cmd: list[str],
+    *,
+    cwd: Path | None = None,
+    env: dict | None = None,
+    stdout_path: Path | None = None,
+    stderr_path: Path | None = None,
+) -> None:
+    # Merge env if provided
+    # With env=None the child inherits our environment directly; only build a dict when merging.
+    final_env = {**os.environ, **env} if env else None
+
+    returncode, stdout, stderr = _spawn(
+        cmd, cwd=cwd, env=final_env, stdout_path=stdout_path, stderr_path=stderr_path
+    )
+    if returncode != 0:
+        raise RuntimeError(
+            f"Command failed ({returncode}): {' '.join(cmd)}\n"
+            f"{stderr.strip() or stdout.strip()}"
+        )
 
 
 def list_rule_benchmarks() -> list[Path]:
     bench_root = ROOT / "benchmarks"
     if not bench_root.is_dir():
         return []
-    
-    benchmarks: list[Path] = []
-    for bench_dir in sorted(bench_root.iterdir()):
-        if not bench_dir.is_dir():
-            continue
-        if (bench_dir / ".git").exists():
-            benchmarks.append(bench_dir)
-    return benchmarks
+
+    # DirEntry.is_dir() is answered from the directory listing itself, no extra stat per child.
+    with os.scandir(bench_root) as it:
+        names = sorted(
+            entry.name for entry in it
+            if entry.is_dir() and os.path.exists(os.path.join(entry.path, ".git"))
+        )
+    return [bench_root / name for name in names]
 
 
 def find_toolchains(benchmark_dir: Path) -> list[Toolchain]:
+    with os.scandir(benchmark_dir) as it:
+        children = [entry for entry in it if entry.is_dir()]
+    children.sort(key=lambda entry: entry.name)
+
     toolchains: list[Toolchain] = []
-    for child in sorted(benchmark_dir.iterdir()):
-        if not child.is_dir():
-            continue
+    for child in children:
         language = child.name
-        
+
         # Look for runner (run_all.sh)
-        runner = child / "run_all.sh"
-        if not runner.exists():
-            runner = child / "run_all"
-        
+        runner = os.path.join(child.path, "run_all.sh")
+        if not os.path.exists(runner):
+            runner = os.path.join(child.path, "run_all")
+
         # Look for aggregator (generate_results.py)
-        aggregator = child / "generate_results.py"
+        aggregator = os.path.join(child.path, "generate_results.py")
 
-        if runner.exists() and aggregator.exists():
-            toolchains.append(Toolchain(language=language, runner=runner, aggregator=aggregator))
+        if os.path.exists(runner) and os.path.exists(aggregator):
+            toolchains.append(Toolchain(language=language, runner=Path(runner), aggregator=Path(aggregator)))
     return toolchains
 
 def ensure_results_path(rule: str, language: str) -> Path:
     out_dir = ROOT / "rules" / rule / language
     out_dir.mkdir(parents=True, exist_ok=True)
-    return out_dir / "RESULTS.md"
+    out_path = out_dir / "RESULTS.md"
+    _WRITTEN_RESULTS.add(out_path)
+    return out_path
+
+def _delete_in_background(path: Path) -> None:
+    # Non-daemon, so the interpreter waits for the deletion to finish before exiting.
+    threading.Thread(target=shutil.rmtree, args=(path,), kwargs={"ignore_errors": True}, daemon=False).start()
+
 
-def execute_runs(rule: str, language: str, runner: Path, num_runs: int, working_dir: Path) -> Path:
-    """Executes the runner N times, collecting output in a temp directory."""
+def _discard_tree(path: Path) -> None:
+    """Moves `path` out of the way and deletes it in the background."""
+    trash = path.parent / f".trash-{uuid.uuid4().hex}"
+    os.rename(path, trash)
+    _delete_in_background(trash)
+
+
+def _sweep_trash() -> None:
+    """Deletes .trash-* directories left behind by an earlier run that was killed mid-deletion."""
+    for trash in [*RUNS_DIR.glob("*/.trash-*"), *LOGS_DIR.glob("*/.trash-*")]:
+        _delete_in_background(trash)
+
+def _one_run(run_output_dir: Path, logs_dir: Path, runner: Path, working_dir: Path) -> None:
+    cmd = ["bash", str(runner), str(run_output_dir)]
+    run_cmd(
+        cmd,
+        cwd=working_dir,
+        stdout_path=logs_dir / f"{run_output_dir.name}.stdout.log",
+        stderr_path=logs_dir / f"{run_output_dir.name}.stderr.log",
+    )
+
+def execute_runs(
+    rule: str,
+    language: str,
+    runner: Path,
+    num_runs: int,
+    working_dir: Path,
+    run_parallelism: int = 1,
+) -> Path:
+    """Executes the runner N times, collecting output in a temp directory.
+
+    With run_parallelism > 1 iterations overlap, which trades timing isolation for throughput.
+    """
     runs_storage = RUNS_DIR / rule / language
     if runs_storage.exists():
-        shutil.rmtree(runs_storage)
+        _discard_tree(runs_storage)
     runs_storage.mkdir(parents=True, exist_ok=True)
 
+    logs_dir = LOGS_DIR / rule / language
+    if logs_dir.exists():
+        _discard_tree(logs_dir)
+    logs_dir.mkdir(parents=True, exist_ok=True)
+
+    # Create every run_<i> directory before the first spawn so iterations start straight away.
+    run_dirs = [runs_storage / f"run_{i}" for i in range(1, num_runs + 1)]
+    for run_dir in run_dirs:
+        run_dir.mkdir()
+
     print(f"Running {rule}/{language} x{num_runs}...")
-    for i in range(1, num_runs + 1):
-        run_id = f"run_{i}"
-        run_output_dir = runs_storage / run_id
-        run_output_dir.mkdir()
-        
-        print(f"  Iteration {i}/{num_runs}")
-        
-        cmd = ["bash", str(runner), str(run_output_dir)]
-        run_cmd(cmd, cwd=working_dir)
-    
+    if run_parallelism <= 1 or num_runs <= 1:
+        for i in range(1, num_runs + 1):
+            print(f"  {rule}/{language} iteration {i}/{num_runs}")
+            _one_run(run_dirs[i - 1], logs_dir, runner, working_dir)
+        return runs_storage
+
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+
+    with ThreadPoolExecutor(max_workers=min(num_runs, run_parallelism)) as pool:
+        futures = {
+            pool.submit(_one_run, run_dir, logs_dir, runner, working_dir): i
+            for i, run_dir in enumerate(run_dirs, start=1)
+        }
+        for done, future in enumerate(as_completed(futures), start=1):
+            future.result()
+            print(f"  {rule}/{language} iteration {futures[future]} finished ({done}/{num_runs})")
+
     return runs_storage
 
 def aggregate_results(aggregator: Path, input_dir: Path, out_path: Path, working_dir: Path) -> None:
@@ -124,31 +220,107 @@ def aggregate_results(aggregator: Path, input_dir: Path, out_path: Path, working
     # We run aggregator in the language dir (working_dir) so it can find weights.json etc.
     run_cmd(cmd, cwd=working_dir)
 
-def process_benchmarks(benchmarks_paths: Iterable[Path], num_runs: int) -> None:
-    for bench_path in benchmarks_paths:
-        rule = bench_path.name
-        toolchains = find_toolchains(bench_path)
-        
-        if not toolchains:
-            print(f"skip: {rule} (no run_all.sh + generate_results.py found)", file=sys.stderr)
+def _aggregate_worker(pending: queue.Queue, failed: threading.Event, errors: list[BaseException]) -> None:
+    """Aggregates finished runs until a None sentinel arrives; after a failure it only drains."""
+    while True:
+        item = pending.get()
+        if item is None:
+            return
+        if failed.is_set():
             continue
-            
-        for tc in toolchains:
-            # Execute Runs
-            runs_dir = execute_runs(rule, tc.language, tc.runner, num_runs, working_dir=bench_path / tc.language)
-            
-            # Aggregate
+        # Everything, progress output included, stays inside the try: if this thread died without
+        # setting `failed`, the producer would block forever on the bounded queue.
+        try:
+            bench_path, tc, runs_dir = item
+            rule = bench_path.name
             out_path = ensure_results_path(rule, tc.language)
             aggregate_results(tc.aggregator, runs_dir, out_path, working_dir=bench_path / tc.language)
+            print(f"done: {rule}/{tc.language} -> {out_path.relative_to(ROOT)}")
+        except BaseException as e:
+            errors.append(e)
+            failed.set()
+
+def process_benchmarks(
+    benchmarks_paths: Iterable[Path], num_runs: int, jobs: int = 1, run_parallelism: int = 1
+) -> None:
+    tasks: list[tuple[Path, Toolchain]] = []
+    # Deduplicate so no two tasks share (and discard each other's) .runs/<rule>/<language> tree.
+    for bench_path in dict.fromkeys(benchmarks_paths):
+        toolchains = find_toolchains(bench_path)
+
+        if not toolchains:
+            print(f"skip: {bench_path.name} (no run_all.sh + generate_results.py found)", file=sys.stderr)
+            continue
+
+        tasks.extend((bench_path, tc) for tc in toolchains)
+
+    if not tasks:
+        return
+
+    # Before any toolchain starts, so only leftovers from previous invocations are swept.
+    _sweep_trash()
+
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+
+    # Two stages: a pool executes runners (each (rule, language) pair has its own working dir and
+    # .runs/<rule>/<language> tree, so toolchains run side by side), while a single consumer thread
+    # aggregates finished toolchains so aggregation overlaps with the runners still in flight.
+    pending: queue.Queue = queue.Queue(maxsize=2)
+    failed = threading.Event()
+    errors: list[BaseException] = []
+    consumer = threading.Thread(target=_aggregate_worker, args=(pending, failed, errors))
+    consumer.start()
+
+    pool = ThreadPoolExecutor(max_workers=max(1, min(len(tasks), jobs)))
+    try:
+        futures = {
+            pool.submit(
+                execute_runs,
+                bench_path.name,
+                tc.language,
+                tc.runner,
+                num_runs,
+                working_dir=bench_path / tc.language,
+                run_parallelism=run_parallelism,
+            ): (bench_path, tc)
+            for bench_path, tc in tasks
+        }
+        for future in as_completed(futures):
+            if failed.is_set():
+                break
+            bench_path, tc = futures[future]
+            pending.put((bench_path, tc, future.result()))
+    except BaseException:
+        failed.set()
+        raise
+    finally:
+        pool.shutdown(wait=True, cancel_futures=failed.is_set())
+        pending.put(None)
+        consumer.join()
+
+    if errors:
+        raise errors[0]
 
 def main(argv: list[str]) -> int:
-    p = argparse.ArgumentParser(description="Regenerate benchmark results.")
+    p = argparse.ArgumentParser(description="Regenerate benchmark results.", allow_abbrev=False)
     p.add_argument("--base", help="Base commit SHA (for PRs).")
     p.add_argument("--head", help="Head commit SHA (for PRs).")
     p.add_argument("--check", action="store_true", help="Fail if regeneration changes tracked files.")
     p.add_argument("--all", action="store_true", help="Regenerate all benchmarks.")
     p.add_argument("--bench", action="append", help="Regenerate specific benchmark (e.g. 'TDD').")
     p.add_argument("--runs", type=int, default=1, help="Number of iterations per benchmark.")
+    p.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of toolchains to run concurrently. Values > 1 sacrifice timing isolation.",
+    )
+    p.add_argument(
+        "--run-parallelism",
+        type=int,
+        default=1,
+        help="Number of iterations of one toolchain to run concurrently. Values > 1 sacrifice timing isolation.",
+    )
     args = p.parse_args(argv)
 
     benchmarks_to_process: list[Path] = [] 
@@ -179,10 +351,13 @@ def main(argv: list[str]) -> int:
         if not (args.all or args.bench):
             print("No benchmark submodule changes detected. Use --all or --bench to force run.")
     else:
-        process_benchmarks(benchmarks_to_process, args.runs)
+        process_benchmarks(benchmarks_to_process, args.runs, args.jobs, args.run_parallelism)
 
     if args.check:
-        run_cmd(["git", "diff", "--exit-code"])
+        # Only RESULTS.md files regenerated by this invocation can have changed; skip git entirely otherwise.
+        dirty = worktree_diff(sorted(str(p) for p in _WRITTEN_RESULTS)) if _WRITTEN_RESULTS else ""
+        if dirty:
+            raise RuntimeError(f"Regeneration changed tracked files:\n{dirty.strip()}")
     return 0
 
 
@@ -3,41 +3,19 @@
 from __future__ import annotations
 
 import os
-import subprocess
 import sys
-from dataclasses import dataclass
+from typing import NamedTuple
 
-
-@dataclass(frozen=True)
-class GitlinkChange:
-    path: str
-
-
-def output(cmd: list[str]) -> str:
-    return subprocess.check_output(cmd, text=True).strip()
+from _git_utils import diff_changes
 
 
-def changed_gitlinks(base: str, head: str) -> list[GitlinkChange]:
-    raw = subprocess.check_output(["git", "diff", "--raw", base, head], text=True)
-    changes: list[GitlinkChange] = []
-    for line in raw.splitlines():
-        parts = line.split("\t", 1)
-        if len(parts) != 2:
-            continue
-        meta, path = parts
-        meta_parts = meta.split()
-        if len(meta_parts) < 3:
-            continue
-        old_mode = meta_parts[0].lstrip(":")
-        new_mode = meta_parts[1]
-        if old_mode == "160000" and new_mode == "160000":
-            changes.append(GitlinkChange(path=path.strip()))
-    return changes
+class GitlinkChange(NamedTuple):
+    path: str
 
 
-def changed_paths(base: str, head: str) -> set[str]:
-    raw = subprocess.check_output(["git", "diff", "--name-only", base, head], text=True)
-    return {p.strip() for p in raw.splitlines() if p.strip()}
+def changed_gitlinks_and_paths(base: str, head: str) -> tuple[list[GitlinkChange], set[str]]:
+    gitlinks, changed = diff_changes(base, head)
+    return [GitlinkChange(path=path) for path in gitlinks], changed
 
 
 def main() -> int:
@@ -47,13 +25,11 @@ def main() -> int:
         print("Missing BASE_SHA/HEAD_SHA", file=sys.stderr)
         return 2
 
-    gitlinks = changed_gitlinks(base, head)
+    gitlinks, changed = changed_gitlinks_and_paths(base, head)
     if not gitlinks:
         print("No submodule pointer changes detected.")
         return 0
 
-    changed = changed_paths(base, head)
-
     failures: list[str] = []
 
     for gl in gitlinks: